@@ -10,8 +10,10 @@ with open('README.rst') as readme_file:
 with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
-requirements = ['Click>=7.0', 'cryptography', 'python-dotenv', 'pyarrow',
-                'pandas<=1.0.3']
+requirements = ['Click>=7.0', 'cryptography', 'python-dotenv', 'pyarrow>=14',
+                'pandas>=2.0']
+
+extras_requirements = {'keyring': ['keyring']}
 
 setup_requirements = []
 
@@ -20,16 +22,13 @@ test_requirements = []
 setup(
     author="Fabian Bergermann",
     author_email='fabian@hellogetsafe.com',
-    python_requires='>=3.5',
+    python_requires='>=3.8',
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
     ],
     description="Encrypt data Python objects using state-of-the-art cryptography, using both a secret key from an environment variable and a user password as second factor.",
@@ -39,6 +38,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
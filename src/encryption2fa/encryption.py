@@ -17,26 +17,67 @@ This is the module-level docstring
 import base64
 import functools
 import getpass
+import hashlib
+import hmac
 import os
+import threading
 import time
+from typing import Any, Callable, List, Optional, Tuple, Union
 
 import dotenv
-from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidSignature
+from cryptography.fernet import Fernet, InvalidToken
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from cryptography.hazmat.primitives import hashes, padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.hmac import HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
-from encryption2fa.serializer import deserializer_parquet, serializer_parquet
+from encryption2fa.serializer import deserializer_dataframe, serializer_arrow
+
+try:
+    import keyring
+    from keyring.errors import KeyringError
+except ImportError:  # keyring is an optional dependency
+    keyring = None
+    KeyringError = Exception
+
+# scrypt cost parameters. OpenSSL computes the p lanes sequentially, so raising p
+# does not spread the work over several cores. Changing any of these values changes
+# the derived keys, hence files encrypted before can no longer be decrypted.
+SCRYPT_N = 2 ** 18
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_MAXMEM = 128 * SCRYPT_R * (SCRYPT_N + SCRYPT_P) + 2 ** 20
+
+KEYRING_SERVICE = "encryption2fa"
+
+# lifetime (in seconds) of the hashed user password in the process memory
+PASSWORD_CACHE_TTL = 15 * 60
+_password_cache = {}
+_password_cache_lock = threading.Lock()
+
+# salt for the password hash, read from the environment on first use
+_salt = None
 
 
 def get_salt_from_env() -> bytes:
     """ Retrieve the salt from an environment variable with key "SALT_FOR_PASSWORD_HASH"
+    The .env file is only read on the first call, use reload_salt() to read it again.
     .. Warning::
     Keep the salt secret for improved input password protection!
 
     >>> get_salt_from_env()
     b'V4MN73IxjLtAB2HmU3E50e4tZjjddOZRjsBl1ogqkPA='
     """
+    if _salt is None:
+        return reload_salt()
+    return _salt
+
+
+def reload_salt() -> bytes:
+    """ Read the salt from the .env file or the environment into the module."""
+    global _salt
     dotenv.load_dotenv()
     salt = os.getenv("SALT_FOR_PASSWORD_HASH")
     if salt is None:
@@ -46,21 +87,30 @@ def get_salt_from_env() -> bytes:
             "Using a default salt instead..."
         )
         salt = "St6jlEKLJ2gVJrcDdNDsTPJZ5bmMI4t-vyjscRpsstE="
-    return salt.encode()
+    _salt = salt.encode()
+    return _salt
 
 
 def hash_password_with_salt(key: bytes, salt: bytes) -> bytes:
     """ Hash a key (or password) using a secure hashing function with a salt.
 
-    To increase security against brute force attacs, increase the parameter n (must be
+    To increase security against brute force attacs, increase SCRYPT_N (must be
     a power of two). The choice of n=2**18 should yield approx. 0.7s runtime on a
-    modern notebook, as a tradeoff of security and convencience.
+    modern notebook, as a tradeoff of security and convencience. The memory limit
+    SCRYPT_MAXMEM follows from the parameters, as scrypt needs 128 * r * n bytes.
 
-    >>> hash_password_with_salt(key=b"my password", salt=b"my salt")
+    >>> base64.urlsafe_b64encode(hash_password_with_salt(b"my password", b"my salt"))
     b'lzxAZtZ7znXCVgDokfGZdjudgrXO9TabIU9-6eyvsw4='
     """
-    kdf = Scrypt(salt=salt, length=32, n=2 ** 18, r=8, p=1, backend=default_backend(), )
-    return base64.urlsafe_b64encode(kdf.derive(key))
+    return hashlib.scrypt(
+        key,
+        salt=salt,
+        n=SCRYPT_N,
+        r=SCRYPT_R,
+        p=SCRYPT_P,
+        dklen=32,
+        maxmem=SCRYPT_MAXMEM,
+    )
 
 
 def validate_password(password: str):
@@ -82,20 +132,122 @@ def validate_password(password: str):
     return password
 
 
-@functools.lru_cache(maxsize=4)
-def hash_and_memoize_user_password(salt: bytes) -> bytes:
+def hash_and_memoize_user_password(salt: bytes, password: str = None) -> bytes:
     """ Protect a user password with a secure hash. Memoize result for convenience.
-    Providing the salt as input to the memoized function avoids side effects of the
-    function when the salt is changed, for example during testing.
+    Only the hash for the latest salt is kept, and only for PASSWORD_CACHE_TTL
+    seconds. Providing the salt as input to the memoized function avoids side effects
+    of the function when the salt is changed, for example during testing.
     ..Note::
     This implementation leaks the salt into the computer RAM. Knowledge of the salt
     makes a brute-force attack on the input password easier. Still this is an
     acceptable behaviour, as the RAM is considered a safe environment in this scope.
     """
-
-    password = getpass.getpass()
+    with _password_cache_lock:
+        return _get_or_hash_user_password(salt, password)
+
+
+def _get_or_hash_user_password(salt: bytes, password: str = None) -> bytes:
+    """ Memoization of hash_and_memoize_user_password, _password_cache_lock must be
+    held by the caller."""
+    cache_key = hashlib.sha256(salt).digest()
+    hashed_key, expiry = _password_cache.get(cache_key, (None, 0.0))
+    if time.monotonic() >= expiry:
+        hashed_key = hash_user_password(salt, password)
+        _password_cache.clear()
+        clear_fernet_cache()
+        expiry = time.monotonic() + PASSWORD_CACHE_TTL
+        _password_cache[cache_key] = (hashed_key, expiry)
+    return hashed_key
+
+
+def hash_user_password(salt: bytes, password: str = None) -> bytes:
+    """ Protect the user password with a secure hash. Ask for it if not given.
+    If enabled, the hash is also kept in the OS keyring for PASSWORD_HASH_KEYRING_TTL
+    seconds, so that later processes can skip the expensive hashing.
+    """
+    if password is None:
+        password = getpass.getpass()
     key = validate_password(password).encode()
-    return hash_password_with_salt(key=key, salt=salt)
+    tag = get_keyring_tag(key=key, salt=salt)
+    hashed_key = read_key_from_keyring(salt, tag)
+    if hashed_key is None:
+        hashed_key = hash_password_with_salt(key=key, salt=salt)
+        save_key_to_keyring(salt, tag, hashed_key)
+    return hashed_key
+
+
+def get_keyring_ttl() -> float:
+    """ Retrieve the lifetime (in seconds) of hashed passwords stored in the OS
+    keyring from an environment variable with key "PASSWORD_HASH_KEYRING_TTL".
+    The keyring is only used if the variable is set to a positive value and the
+    optional dependency keyring is installed.
+
+    >>> get_keyring_ttl()
+    0.0
+    """
+    if keyring is None:
+        return 0.0
+    try:
+        return float(os.getenv("PASSWORD_HASH_KEYRING_TTL", 0))
+    except ValueError:
+        # an invalid value disables the keyring
+        return 0.0
+
+
+def get_keyring_account(salt: bytes) -> str:
+    """ Name of the keyring entry for a salt. Account names are often stored
+    unencrypted, so the name must not depend on the password.
+
+    >>> get_keyring_account(b"my salt")
+    'fc3c0962b327db0ee1b7e53f4b3d2073269fb9675fad6ce731625130b79000ae'
+    """
+    return hashlib.sha256(salt).hexdigest()
+
+
+def get_keyring_tag(key: bytes, salt: bytes) -> str:
+    """ Identify a password by a HMAC tag, never by the password. The tag is only
+    stored inside the (encrypted) keyring value, next to the hashed password.
+
+    >>> get_keyring_tag(key=b"my password", salt=b"my salt")
+    '1f82248aa4249b583cad49a8107efd05b7e1823bd007735d14a1c0212545122f'
+    """
+    return hmac.new(salt, key, hashlib.sha256).hexdigest()
+
+
+def read_key_from_keyring(salt: bytes, tag: str):
+    """ Look up the hashed password for a salt in the OS keyring. Expired entries
+    are removed. Returns None if there is no valid entry for the password tag or the
+    keyring is disabled."""
+    ttl = get_keyring_ttl()
+    if ttl <= 0:
+        return None
+    account = get_keyring_account(salt)
+    try:
+        entry = keyring.get_password(KEYRING_SERVICE, account)
+        if entry is None:
+            return None
+        timestamp, stored_tag, hashed_key = entry.split(":")
+        if time.time() - float(timestamp) > ttl:
+            keyring.delete_password(KEYRING_SERVICE, account)
+            return None
+        if not hmac.compare_digest(stored_tag, tag):
+            return None
+        return base64.urlsafe_b64decode(hashed_key)
+    except (KeyringError, ValueError):
+        return None
+
+
+def save_key_to_keyring(salt: bytes, tag: str, hashed_key: bytes) -> None:
+    """ Store a hashed password in the OS keyring as "timestamp:tag:hash",
+    replacing the entry for the salt. Does nothing if the keyring is disabled."""
+    if get_keyring_ttl() <= 0:
+        return
+    hashed_key = base64.urlsafe_b64encode(hashed_key).decode()
+    try:
+        entry = f"{time.time()}:{tag}:{hashed_key}"
+        keyring.set_password(KEYRING_SERVICE, get_keyring_account(salt), entry)
+    except KeyringError:
+        pass
 
 
 def get_user_key() -> bytes:
@@ -104,19 +256,237 @@ def get_user_key() -> bytes:
     return hash_and_memoize_user_password(salt)
 
 
+def _is_password_cached(salt: bytes) -> bool:
+    """ Check for an unexpired hash of the user password for a salt,
+    _password_cache_lock must be held by the caller."""
+    cache_key = hashlib.sha256(salt).digest()
+    _, expiry = _password_cache.get(cache_key, (None, 0.0))
+    return time.monotonic() < expiry
+
+
+def prewarm_user_key() -> Optional[threading.Thread]:
+    """ Ask for the user password now and hash it in a background thread, so that
+    the user does not wait for the slow hashing when the key is needed later.
+    Returns the thread, or None if a valid hash is memoized already and nothing is
+    asked.
+    ..Note::
+    The password prompt has to happen on the calling (main) thread, before the
+    hashing starts. A later get_user_key() blocks until the hashing is finished and
+    then returns the memoized result without asking again.
+    """
+    salt = get_salt_from_env()
+    # hold the lock from here, so that get_user_key() cannot ask a second time
+    _password_cache_lock.acquire()
+    try:
+        if _is_password_cached(salt):
+            _password_cache_lock.release()
+            return None
+        password = validate_password(getpass.getpass())
+    except BaseException:
+        _password_cache_lock.release()
+        raise
+
+    def prewarm():
+        try:
+            _get_or_hash_user_password(salt, password)
+        finally:
+            _password_cache_lock.release()
+
+    thread = threading.Thread(target=prewarm, daemon=True)
+    try:
+        thread.start()
+    except BaseException:
+        _password_cache_lock.release()
+        raise
+    return thread
+
+
+def derive_fernet_key(key: bytes, fernet_salt: bytes = b"") -> bytes:
+    """ Derive a valid fernet key from a key with HKDF, separated per fernet_salt.
+
+    >>> derive_fernet_key(b"my passwd", b"my salt")
+    b'wD0sQKBbLfy1nuN9isyfYWar6Unms8fLvG5URGqZWUU='
+    """
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=fernet_salt,
+        info=b"fernet-key",
+        backend=default_backend(),
+    )
+    return base64.urlsafe_b64encode(hkdf.derive(key))
+
+
 def get_fernet_key(key: bytes) -> bytes:
     """ Derive a valid fernet key from an arbitrary-length key (or password).
+    Only used for tokens encrypted before the switch to derive_fernet_key.
 
     >>> get_fernet_key(b"my passwd")
     b'IoNIrq0z4XYkDv_lt5qAc-elNAfbkvErUkzsMLt39qM='
     """
-    digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-    digest.update(key)
-    return base64.urlsafe_b64encode(digest.finalize())
+    return base64.urlsafe_b64encode(hashlib.sha256(key).digest())
 
 
-def get_fernet_object(key: bytes = None, fernet_salt: bytes = b"") -> Fernet:
-    """ Provides a fernet object
+@functools.lru_cache(maxsize=1)
+def check_aes_hardware_support() -> bool:
+    """ Check if the CPU provides AES instructions (e.g. AES-NI), which OpenSSL uses
+    automatically. Without them, encryption of large data is a lot slower.
+    The CPU flags are read from /proc/cpuinfo; on other systems support is assumed.
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpuinfo = f.read().splitlines()
+    except OSError:
+        return True
+    flags = set()
+    for line in cpuinfo:
+        if line.startswith(("flags", "Features")):
+            flags.update(line.partition(":")[2].split())
+    if not flags or "aes" in flags:
+        return True
+    print(
+        "*** WARNING: No hardware support for AES found! *** \n"
+        f"Encryption with {default_backend().openssl_version_text()} "
+        "will be slow for large data."
+    )
+    return False
+
+
+class RawFernet:
+    """ Fernet encryption without the outer base64 encoding of the token.
+    The token layout follows the Fernet specs (version | timestamp | IV | ciphertext |
+    HMAC), as raw bytes. Meant for files, which need no string-safe tokens.
+
+    >>> fernet = RawFernet(derive_fernet_key(b"my passwd"))
+    >>> fernet.decrypt(fernet.encrypt(b"my data"))
+    b'my data'
+    """
+
+    version = b"\x80"
+
+    def __init__(self, key: bytes):
+        key = base64.urlsafe_b64decode(key)
+        if len(key) != 32:
+            raise ValueError("Fernet key must be 32 url-safe base64-encoded bytes.")
+        self._signing_key = key[:16]
+        self._encryption_key = key[16:]
+
+    def encrypt(self, data: bytes) -> bytes:
+        timestamp = int(time.time()).to_bytes(8, "big")
+        iv = os.urandom(16)
+        padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        encryptor = self._get_cipher(iv).encryptor()
+        ciphertext = encryptor.update(padder.update(data) + padder.finalize())
+        ciphertext += encryptor.finalize()
+        basic_parts = self.version + timestamp + iv + ciphertext
+        return basic_parts + self._get_hmac(basic_parts).finalize()
+
+    def decrypt(self, token: bytes) -> bytes:
+        self._verify(token)
+        iv, ciphertext = token[9:25], token[25:-32]
+        decryptor = self._get_cipher(iv).decryptor()
+        plaintext_padded = decryptor.update(ciphertext) + decryptor.finalize()
+        unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+        try:
+            return unpadder.update(plaintext_padded) + unpadder.finalize()
+        except ValueError:
+            raise InvalidToken
+
+    def encryptor(self, fileobj) -> "RawFernetWriter":
+        """ Provides a writable stream that encrypts into fileobj on the fly."""
+        return RawFernetWriter(self, fileobj)
+
+    def extract_timestamp(self, token: bytes) -> int:
+        self._verify(token)
+        return int.from_bytes(token[1:9], "big")
+
+    def _verify(self, token: bytes) -> None:
+        if (
+            not isinstance(token, bytes)
+            or token[:1] != self.version
+            or len(token) < 73
+            or (len(token) - 57) % 16
+        ):
+            raise InvalidToken
+        try:
+            self._get_hmac(token[:-32]).verify(token[-32:])
+        except InvalidSignature:
+            raise InvalidToken
+
+    def _get_cipher(self, iv: bytes) -> Cipher:
+        algorithm = algorithms.AES(self._encryption_key)
+        return Cipher(algorithm, modes.CBC(iv), backend=default_backend())
+
+    def _get_hmac(self, data: bytes) -> HMAC:
+        h = HMAC(self._signing_key, hashes.SHA256(), backend=default_backend())
+        h.update(data)
+        return h
+
+
+class RawFernetWriter:
+    """ Writable stream producing the same raw token as RawFernet.encrypt, without
+    holding the plaintext and the ciphertext in memory at once. The ciphertext is
+    written to fileobj as it is produced and the HMAC is appended on close().
+    If an exception leaves the with-block, the token is not finished and fails to
+    decrypt.
+
+    >>> import io
+    >>> fernet = RawFernet(derive_fernet_key(b"my passwd"))
+    >>> buffer = io.BytesIO()
+    >>> with fernet.encryptor(buffer) as stream:
+    ...     _ = stream.write(b"my ")
+    ...     _ = stream.write(b"data")
+    >>> fernet.decrypt(buffer.getvalue())
+    b'my data'
+    """
+
+    def __init__(self, fernet: RawFernet, fileobj):
+        self.timestamp = int(time.time())
+        self.closed = False
+        self._fileobj = fileobj
+        iv = os.urandom(16)
+        header = fernet.version + self.timestamp.to_bytes(8, "big") + iv
+        self._padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        self._encryptor = fernet._get_cipher(iv).encryptor()
+        self._hmac = fernet._get_hmac(header)
+        self._fileobj.write(header)
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed stream")
+        # cryptography only accepts immutable buffers, e.g. no pyarrow buffers
+        data = bytes(data)
+        self._write_ciphertext(self._encryptor.update(self._padder.update(data)))
+        return len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._write_ciphertext(
+            self._encryptor.update(self._padder.finalize()) + self._encryptor.finalize()
+        )
+        self._fileobj.write(self._hmac.finalize())
+
+    def _write_ciphertext(self, ciphertext: bytes) -> None:
+        self._hmac.update(ciphertext)
+        self._fileobj.write(ciphertext)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.closed = True
+
+
+def get_fernet_object(
+    key: bytes = None, fernet_salt: bytes = b"", raw: bool = False, legacy: bool = False
+) -> Union[Fernet, RawFernet]:
+    """ Provides a fernet object. With raw=True, the tokens are not base64 encoded.
+    With legacy=True, the key is derived as before the switch to derive_fernet_key.
 
     >>> get_fernet_object(b"bla", b"blo") #doctest: +ELLIPSIS
     Caution: This is is an unsafe mode. Please use this for debugging only!
@@ -126,46 +496,87 @@ def get_fernet_object(key: bytes = None, fernet_salt: bytes = b"") -> Fernet:
         print("Caution: This is is an unsafe mode. Please use this for debugging only!")
     else:
         key = get_user_key()
-    return Fernet(get_fernet_key(key + fernet_salt))
+        if legacy:
+            # earlier versions used the base64 encoded hash of the user password
+            key = base64.urlsafe_b64encode(key)
+    check_aes_hardware_support()
+    return build_fernet(key, fernet_salt, raw=raw, legacy=legacy)
+
+
+@functools.lru_cache(maxsize=128)
+def build_fernet(
+    key: bytes, fernet_salt: bytes, raw: bool = False, legacy: bool = False
+) -> Union[Fernet, RawFernet]:
+    """ Build the fernet object for a key and a fernet salt. Memoized, as many
+    small records are often encrypted with the same key and salt."""
+    if legacy:
+        fernet_key = get_fernet_key(key + fernet_salt)
+    else:
+        fernet_key = derive_fernet_key(key, fernet_salt)
+    fernet_class = RawFernet if raw else Fernet
+    return fernet_class(fernet_key)
 
 
 def print_encryption_timestamp(fernet_object: Fernet, token: bytes) -> None:
     """ Print the encryption timestamp of a token in raw and human-readable form"""
-    timestamp = fernet_object.extract_timestamp(token)
+    print_timestamp(fernet_object.extract_timestamp(token))
+
+
+def print_timestamp(timestamp: int) -> None:
+    """ Print an encryption timestamp in raw and human-readable form"""
     print(
         f"Timestamp of encryption: {timestamp} \n"
         f"Date created: {time.ctime(timestamp)}"
     )
 
 
-def encrypt_with_fernet(data: bytes, fernet: Fernet) -> bytes:
+def encrypt_with_fernet(data: bytes, fernet: Fernet, verbose: bool = False) -> bytes:
     """
     >>> fernet = get_fernet_object(b"pwd", b"salt..")
     Caution: This is is an unsafe mode. Please use this for debugging only!
-    >>> encrypt_with_fernet(data=b"my data", fernet=fernet) #doctest: +ELLIPSIS
+    >>> encrypt_with_fernet(b"my data", fernet, verbose=True) #doctest: +ELLIPSIS
     Timestamp of encryption: ...
     Date created: ...
     b'...
     """
     token = fernet.encrypt(data)
-    print_encryption_timestamp(fernet, token)
+    if verbose:
+        print_encryption_timestamp(fernet, token)
     return token
 
 
-def decrypt_with_fernet(token: bytes, fernet: Fernet) -> bytes:
+def decrypt_with_fernet(token: bytes, fernet: Fernet, verbose: bool = False) -> bytes:
     """
     >>> fernet = get_fernet_object(b"pwd", b"salt..")
     Caution: This is is an unsafe mode. Please use this for debugging only!
-    >>> token = encrypt_with_fernet(data=b"my data", fernet=fernet) #doctest: +ELLIPSIS
-    Timestamp of encryption: ...
-    Date created: ...
-    >>> decrypt_with_fernet(token, fernet) #doctest: +ELLIPSIS
+    >>> token = encrypt_with_fernet(data=b"my data", fernet=fernet)
+    >>> decrypt_with_fernet(token, fernet, verbose=True) #doctest: +ELLIPSIS
     Timestamp of encryption: ...
     Date created: ...
     b'my data'
     """
-    print_encryption_timestamp(fernet, token)
-    return fernet.decrypt(token)
+    # authenticate the token before reading anything from it
+    data = fernet.decrypt(token)
+    if verbose:
+        print_encryption_timestamp(fernet, token)
+    return data
+
+
+def decrypt_with_fallback(
+    token: bytes,
+    fernet: Fernet,
+    get_legacy_fernet: Callable[[], Fernet],
+    verbose: bool = False,
+) -> bytes:
+    """ Decrypt a token, falling back to the fernet object with the key derivation
+    of earlier versions (see get_fernet_object) for older tokens. The legacy fernet
+    object is only built by get_legacy_fernet() if the first attempt fails."""
+    try:
+        return decrypt_with_fernet(token=token, fernet=fernet, verbose=verbose)
+    except InvalidToken:
+        pass
+    legacy_fernet = get_legacy_fernet()
+    return decrypt_with_fernet(token=token, fernet=legacy_fernet, verbose=verbose)
 
 
 def get_new_salt(salt_length: int = 32):
@@ -178,37 +589,106 @@ def get_new_salt(salt_length: int = 32):
     return salt
 
 
-def encrypt_data(data, serializer, salt: str = "") -> bytes:
-    fernet = get_fernet_object(fernet_salt=salt.encode())
-    return encrypt_with_fernet(data=serializer(data), fernet=fernet)
+def encrypt_data(
+    data, serializer, salt: str = "", raw: bool = False, verbose: bool = False
+) -> bytes:
+    fernet = get_fernet_object(fernet_salt=salt.encode(), raw=raw)
+    return encrypt_with_fernet(data=serializer(data), fernet=fernet, verbose=verbose)
 
 
-def decrypt_data(token: bytes, deserializer, salt: str = ""):
-    fernet = get_fernet_object(fernet_salt=salt.encode())
-    return deserializer(decrypt_with_fernet(token=token, fernet=fernet))
+def decrypt_data(
+    token: bytes, deserializer, salt: str = "", raw: bool = False, verbose: bool = False
+):
+    fernet = get_fernet_object(fernet_salt=salt.encode(), raw=raw)
+    get_legacy_fernet = functools.partial(
+        get_fernet_object, fernet_salt=salt.encode(), raw=raw, legacy=True
+    )
+    data = decrypt_with_fallback(token, fernet, get_legacy_fernet, verbose=verbose)
+    return deserializer(data)
+
+
+def get_file_fernet_object(
+    user_key: bytes, file: str, raw: bool = True, legacy: bool = False
+) -> Union[Fernet, RawFernet]:
+    """ Provides the fernet object for a file, salted with the file name."""
+    if legacy:
+        user_key = base64.urlsafe_b64encode(user_key)
+    fernet_salt = os.path.basename(file).encode()
+    return build_fernet(user_key, fernet_salt, raw=raw, legacy=legacy)
+
+
+def save_encrypted(data, file: str, verbose: bool = False) -> None:
+    save_encrypted_many([(data, file)], verbose=verbose)
+
+
+def read_encrypted(file: str, verbose: bool = False):
+    return read_encrypted_many([file], verbose=verbose)[0]
+
+
+def save_encrypted_many(items: List[Tuple[Any, str]], verbose: bool = False) -> None:
+    """ Encrypt and save several (data, file) pairs, deriving the user key once."""
+    user_key = get_user_key()
+    check_aes_hardware_support()
+    for data, file in items:
+        fernet = get_file_fernet_object(user_key, file)
+        # stream into a separate file, so that a failure keeps the existing file
+        partial_file = f"{file}.partial"
+        with open(partial_file, "wb") as f:
+            try:
+                with fernet.encryptor(f) as stream:
+                    serializer_arrow(data, sink=stream)
+            except BaseException:
+                f.close()
+                os.remove(partial_file)
+                raise
+        os.replace(partial_file, file)
+        if verbose:
+            print_timestamp(stream.timestamp)
+
+
+def read_encrypted_many(files: List[str], verbose: bool = False) -> list:
+    """ Read and decrypt several files, deriving the user key once."""
+    user_key = get_user_key()
+    check_aes_hardware_support()
+    data = []
+    for file in files:
+        with open(file, "rb") as f:
+            token = f.read()
+        # files written by earlier versions contain base64 encoded fernet tokens
+        raw = token[:1] == RawFernet.version
+        fernet = get_file_fernet_object(user_key, file, raw=raw)
+        get_legacy_fernet = functools.partial(
+            get_file_fernet_object, user_key, file, raw=raw, legacy=True
+        )
+        plaintext = decrypt_with_fallback(
+            token, fernet, get_legacy_fernet, verbose=verbose
+        )
+        data.append(deserializer_dataframe(plaintext))
+    return data
 
 
-def save_encrypted(data, file: str) -> None:
-    filename = os.path.basename(file)
-    encrypted_data = encrypt_data(
-        data=data, serializer=serializer_parquet, salt=filename
-    )
-    with open(file, "wb") as f:
-        f.write(encrypted_data)
+def clear_password_cache():
+    """
+    >>> clear_password_cache()
+    """
+    with _password_cache_lock:
+        _password_cache.clear()
+    clear_fernet_cache()
 
 
-def read_encrypted(file: str):
-    filename = os.path.basename(file)
-    with open(file, "rb") as f:
-        token = f.read()
-    return decrypt_data(token=token, deserializer=deserializer_parquet, salt=filename)
+def clear_fernet_cache():
+    """
+    >>> clear_fernet_cache()
+    """
+    build_fernet.cache_clear()
 
 
-def clear_password_cache():
+def clear_salt_cache():
     """
-    >>> clear_password_cache()
+    >>> clear_salt_cache()
     """
-    hash_and_memoize_user_password.cache_clear()
+    global _salt
+    _salt = None
 
 
 if __name__ == "__main__":
@@ -19,7 +19,19 @@ def get_test_dataframe():
     return df
 
 
+def assert_dataframe_equal(df, df_out):
+    """ Deserialized dataframes are Arrow-backed, compare them by value."""
+    import pandas as pd
+
+    pd.testing.assert_frame_equal(df, df_out.astype(df.dtypes), check_index_type=False)
+
+
 class Test(TestCase):
+    def setUp(self):
+        from encryption2fa.encryption import clear_salt_cache
+
+        clear_salt_cache()
+
     @mock.patch("sys.stdin")
     def test_uses_stdin_as_default_input(self, mock_input):
         import getpass
@@ -34,15 +46,128 @@ class Test(TestCase):
         {"SALT_FOR_PASSWORD_HASH": "V4MN73IxjLtAB2HmU3E50e4tZjjddOZRjsBl1ogqkPA="},
     )
     def test_get_hashed_input_password(self, mock_getpass):
+        import base64
         from encryption2fa.encryption import get_user_key
 
         mock_getpass.return_value = "dfdfdfdf"
         out = get_user_key()
-        self.assertEqual(out, b"Upm3bmsC6yr1TY0P8G-m-mws6rnOqQVSgpukVGwP-gs=")
+        self.assertEqual(
+            base64.urlsafe_b64encode(out),
+            b"Upm3bmsC6yr1TY0P8G-m-mws6rnOqQVSgpukVGwP-gs=",
+        )
+
+    def test_reload_salt(self):
+        from encryption2fa.encryption import get_salt_from_env, reload_salt
+
+        with mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "old salt"}):
+            self.assertEqual(get_salt_from_env(), b"old salt")
+        with mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "new salt"}):
+            self.assertEqual(get_salt_from_env(), b"old salt")
+            self.assertEqual(reload_salt(), b"new salt")
+            self.assertEqual(get_salt_from_env(), b"new salt")
+
+    @mock.patch("getpass.getpass")
+    @mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "some salt"})
+    def test_password_cache_expires(self, mock_getpass):
+        from encryption2fa import encryption
+
+        mock_getpass.return_value = "dfdfdfdf"
+        encryption.clear_password_cache()
+        with mock.patch.object(encryption, "hash_password_with_salt") as mock_hash:
+            encryption.get_user_key()
+            encryption.get_user_key()
+            self.assertEqual(mock_getpass.call_count, 1)
+            with mock.patch.object(encryption, "PASSWORD_CACHE_TTL", 0):
+                encryption.clear_password_cache()
+                encryption.get_user_key()
+                encryption.get_user_key()
+            self.assertEqual(mock_getpass.call_count, 3)
+            self.assertEqual(mock_hash.call_count, 3)
+        encryption.clear_password_cache()
+
+    @mock.patch("getpass.getpass")
+    @mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "some salt"})
+    def test_fernet_cache(self, mock_getpass):
+        from encryption2fa import encryption
+        from encryption2fa.serializer import serializer_pickle
+
+        mock_getpass.return_value = "dfdfdfdf"
+        encryption.clear_password_cache()
+        with mock.patch.object(
+            encryption, "hash_password_with_salt", return_value=bytes(32)
+        ):
+            encryption.encrypt_data("data", serializer=serializer_pickle, salt="a")
+            hits = encryption.build_fernet.cache_info().hits
+            encryption.encrypt_data("data", serializer=serializer_pickle, salt="a")
+            self.assertEqual(encryption.build_fernet.cache_info().hits, hits + 1)
+            encryption.clear_password_cache()
+            self.assertEqual(encryption.build_fernet.cache_info().currsize, 0)
+            with mock.patch.object(encryption, "PASSWORD_CACHE_TTL", 0):
+                encryption.encrypt_data("data", serializer=serializer_pickle, salt="a")
+                self.assertEqual(encryption.build_fernet.cache_info().currsize, 1)
+                # the expired hash is refreshed, which drops the old fernet objects
+                encryption.get_user_key()
+                self.assertEqual(encryption.build_fernet.cache_info().currsize, 0)
+        encryption.clear_password_cache()
+
+    @mock.patch("getpass.getpass")
+    @mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "prewarm salt"})
+    def test_prewarm_user_key(self, mock_getpass):
+        from encryption2fa import encryption
+
+        mock_getpass.return_value = "dfdfdfdf"
+        encryption.clear_password_cache()
+        thread = encryption.prewarm_user_key()
+        key = encryption.get_user_key()
+        thread.join()
+        self.assertEqual(mock_getpass.call_count, 1)
+        mock_getpass.return_value = "wrong password"
+        self.assertIsNone(encryption.prewarm_user_key())
+        self.assertEqual(mock_getpass.call_count, 1)
+        mock_getpass.return_value = "dfdfdfdf"
+        encryption.clear_password_cache()
+        self.assertEqual(encryption.get_user_key(), key)
+        encryption.clear_password_cache()
+
+    @mock.patch("getpass.getpass")
+    @mock.patch.dict(
+        "os.environ",
+        {"SALT_FOR_PASSWORD_HASH": "keyring salt", "PASSWORD_HASH_KEYRING_TTL": "60"},
+    )
+    def test_get_user_key_from_keyring(self, mock_getpass):
+        from encryption2fa import encryption
+
+        mock_getpass.return_value = "dfdfdfdf"
+        store = {}
+        mock_keyring = mock.Mock()
+        mock_keyring.get_password.side_effect = lambda s, tag: store.get(tag)
+        mock_keyring.set_password.side_effect = lambda s, tag, v: store.update({tag: v})
+        with mock.patch.object(encryption, "keyring", mock_keyring):
+            encryption.clear_password_cache()
+            key = encryption.get_user_key()
+            encryption.clear_password_cache()
+            with mock.patch.object(encryption, "hash_password_with_salt") as mock_hash:
+                self.assertEqual(encryption.get_user_key(), key)
+                mock_hash.assert_not_called()
+            encryption.clear_password_cache()
+            mock_getpass.return_value = "another password"
+            self.assertNotEqual(encryption.get_user_key(), key)
+            encryption.clear_password_cache()
+        account = encryption.get_keyring_account(b"keyring salt")
+        self.assertEqual(list(store), [account])
+        self.assertNotIn(b"another password", store[account].encode())
+
+    @mock.patch.dict("os.environ", {"PASSWORD_HASH_KEYRING_TTL": "not a number"})
+    def test_invalid_keyring_ttl(self):
+        from encryption2fa import encryption
+
+        with mock.patch.object(encryption, "keyring", mock.Mock()):
+            self.assertEqual(encryption.get_keyring_ttl(), 0.0)
 
     @mock.patch("getpass.getpass")
     @mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "some salt"})
     def test_decrypt_data_pickle(self, mock_getpass):
+        from encryption2fa import encryption
         from encryption2fa.encryption import encrypt_data, decrypt_data
         from encryption2fa.serializer import serializer_pickle, deserializer_pickle
 
@@ -50,7 +175,10 @@ class Test(TestCase):
         salt = "some salt"
         data = "secret data as a string"
         token = encrypt_data(data=data, serializer=serializer_pickle, salt=salt)
-        out = decrypt_data(token=token, deserializer=deserializer_pickle, salt=salt)
+        # the legacy key derivation is only needed for older tokens
+        with mock.patch.object(encryption, "get_fernet_key") as mock_legacy_key:
+            out = decrypt_data(token=token, deserializer=deserializer_pickle, salt=salt)
+            mock_legacy_key.assert_not_called()
         self.assertEqual(data, out)
 
     @mock.patch("getpass.getpass")
@@ -64,7 +192,41 @@ class Test(TestCase):
         salt = "some salt"
         token = encrypt_data(data=df, serializer=serializer_parquet, salt=salt)
         df_out = decrypt_data(token=token, deserializer=deserializer_parquet, salt=salt)
-        self.assertTrue(df.equals(df_out))
+        assert_dataframe_equal(df, df_out)
+
+    @mock.patch("getpass.getpass")
+    @mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "some salt"})
+    def test_decrypt_data_legacy_key(self, mock_getpass):
+        from encryption2fa.encryption import (
+            decrypt_data,
+            encrypt_with_fernet,
+            get_fernet_object,
+        )
+        from encryption2fa.serializer import serializer_pickle, deserializer_pickle
+
+        mock_getpass.return_value = "dfdfdfdf"
+        salt = "some salt"
+        data = "secret data as a string"
+        fernet = get_fernet_object(fernet_salt=salt.encode(), legacy=True)
+        token = encrypt_with_fernet(data=serializer_pickle(data), fernet=fernet)
+        out = decrypt_data(token=token, deserializer=deserializer_pickle, salt=salt)
+        self.assertEqual(data, out)
+
+    def test_serializer_compression(self):
+        from encryption2fa.serializer import (
+            deserializer_arrow,
+            deserializer_parquet,
+            serializer_arrow,
+            serializer_parquet,
+        )
+
+        df = get_test_dataframe()
+        for compression in ["lz4", "zstd", "snappy"]:
+            data = serializer_parquet(df, compression=compression)
+            assert_dataframe_equal(df, deserializer_parquet(data))
+        for compression in [None, "lz4", "zstd"]:
+            data = serializer_arrow(df, compression=compression)
+            assert_dataframe_equal(df, deserializer_arrow(data))
 
     @mock.patch("getpass.getpass")
     @mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "short salt"})
@@ -79,9 +241,38 @@ class Test(TestCase):
             InvalidToken, decrypt_data, b"invalid token", serializer_pickle, salt
         )
 
+    def test_raw_fernet_matches_fernet_specs(self):
+        import base64
+        from cryptography.fernet import Fernet, InvalidToken
+        from encryption2fa.encryption import RawFernet
+
+        key = Fernet.generate_key()
+        fernet, raw_fernet = Fernet(key), RawFernet(key)
+        data = b"secret data" * 10
+        token = fernet.encrypt(data)
+        self.assertEqual(raw_fernet.decrypt(base64.urlsafe_b64decode(token)), data)
+        raw_token = raw_fernet.encrypt(data)
+        self.assertEqual(fernet.decrypt(base64.urlsafe_b64encode(raw_token)), data)
+        tampered = raw_token[:-1] + bytes([raw_token[-1] ^ 1])
+        self.assertRaises(InvalidToken, raw_fernet.decrypt, tampered)
+
+    @mock.patch("sys.stdout", new_callable=StringIO)
+    def test_check_aes_hardware_support_missing(self, mock_stdout):
+        from encryption2fa.encryption import check_aes_hardware_support
+
+        cpuinfo = "processor\t: 0\nflags\t\t: fpu vme sse sse2\n"
+        check_aes_hardware_support.cache_clear()
+        try:
+            with mock.patch("builtins.open", mock.mock_open(read_data=cpuinfo)):
+                self.assertFalse(check_aes_hardware_support())
+        finally:
+            check_aes_hardware_support.cache_clear()
+        self.assertIn("No hardware support for AES", mock_stdout.getvalue())
+
     @mock.patch("getpass.getpass")
     @mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "short salt"})
     def test_read_encrypted(self, mock_getpass):
+        import pandas as pd
         from encryption2fa.encryption import save_encrypted, read_encrypted
 
         mock_getpass.return_value = "dfdfdfdf"
@@ -89,7 +280,69 @@ class Test(TestCase):
         data = get_test_dataframe()
         save_encrypted(data=data, file=testfile)
         data_out = read_encrypted(file=testfile)
-        self.assertTrue(data.equals(data_out))
+        assert_dataframe_equal(data, data_out)
+        for dtype in data_out.dtypes:
+            self.assertIsInstance(dtype, pd.ArrowDtype)
+
+    @mock.patch("getpass.getpass")
+    @mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "short salt"})
+    def test_save_encrypted_fail(self, mock_getpass):
+        import os
+        import tempfile
+        from encryption2fa.encryption import save_encrypted
+
+        mock_getpass.return_value = "dfdfdfdf"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            testfile = os.path.join(tmpdir, "testfile.encrypted")
+            with open(testfile, "wb") as f:
+                f.write(b"existing data")
+            self.assertRaises(TypeError, save_encrypted, "no dataframe", testfile)
+            with open(testfile, "rb") as f:
+                self.assertEqual(f.read(), b"existing data")
+            self.assertEqual(os.listdir(tmpdir), ["testfile.encrypted"])
+            missing = os.path.join(tmpdir, "missing", "testfile.encrypted")
+            with self.assertRaises(FileNotFoundError) as cm:
+                save_encrypted(get_test_dataframe(), missing)
+            # the error of open() itself, not one raised during the cleanup
+            self.assertIsNone(cm.exception.__context__)
+
+    @mock.patch("getpass.getpass")
+    @mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "short salt"})
+    def test_read_encrypted_parquet(self, mock_getpass):
+        import os
+        import tempfile
+        from encryption2fa.encryption import encrypt_data, read_encrypted
+        from encryption2fa.serializer import serializer_parquet
+
+        mock_getpass.return_value = "dfdfdfdf"
+        filename = "testfile_parquet.encrypted"
+        data = get_test_dataframe()
+        token = encrypt_data(data=data, serializer=serializer_parquet, salt=filename)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            testfile = os.path.join(tmpdir, filename)
+            with open(testfile, "wb") as f:
+                f.write(token)
+            data_out = read_encrypted(file=testfile)
+        assert_dataframe_equal(data, data_out)
+
+    @mock.patch("getpass.getpass")
+    @mock.patch.dict("os.environ", {"SALT_FOR_PASSWORD_HASH": "short salt"})
+    def test_read_encrypted_many(self, mock_getpass):
+        import os
+        import tempfile
+        from encryption2fa.encryption import save_encrypted_many, read_encrypted_many
+
+        mock_getpass.return_value = "dfdfdfdf"
+        data = [get_test_dataframe(), get_test_dataframe().iloc[:2]]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            testfiles = [
+                os.path.join(tmpdir, "testfile_1.encrypted"),
+                os.path.join(tmpdir, "testfile_2.encrypted"),
+            ]
+            save_encrypted_many(list(zip(data, testfiles)))
+            data_out = read_encrypted_many(testfiles)
+        for df, df_out in zip(data, data_out):
+            assert_dataframe_equal(df, df_out)
 
 
 if __name__ == "__main__":